@@ -6,16 +6,16 @@ from pathlib import Path
 
 from dotenv import load_dotenv
 
-from hipaa_rag import SecureRAG
+from hipaa_rag import DocumentHandle, SecureRAG
 
 load_dotenv()
 
 
 def make_sample_pdf(image_paths: list[Path], out_path: Path) -> None:
     """Create a multi-page PDF from image files (for demo)."""
-    import fitz
+    import pymupdf
 
-    doc = fitz.open()
+    doc = pymupdf.open()
     for img_path in image_paths:
         if not img_path.exists():
             continue
@@ -30,12 +30,13 @@ def main():
 
     rag = SecureRAG(model="qwen2-vl", enable_audit_log=True)
     test_data = Path(__file__).parent.parent / "test_data"
-    bronchitis_chart = test_data / "bronchitis_chart.png"
+    # Load the chart once; both calls below reuse the same page bytes
+    bronchitis_chart = rag.prepare(DocumentHandle.open(test_data / "bronchitis_chart.png"))
 
     # --- 1. Single image (same API as before) ---
     print("1. Simple query (single image)\n")
     result = rag.query(
-        document=str(bronchitis_chart),
+        document=bronchitis_chart,
         question="What is the patient's primary diagnosis with ICD-10 code?",
     )
     print(f"Answer: {result.answer}\n")
@@ -51,7 +52,7 @@ def main():
         "prescribed_medications",
     ]
     extracted = rag.extract_structured_data(
-        document=str(bronchitis_chart),
+        document=bronchitis_chart,
         fields=fields,
     )
     print("Extracted fields:")
@@ -67,8 +68,9 @@ def main():
             pdf_path = Path(f.name)
         try:
             make_sample_pdf(images, pdf_path)
+            pdf = rag.prepare(pdf_path)
             result = rag.query(
-                document=str(pdf_path),
+                document=pdf,
                 question="What is the chief complaint or reason for visit?",
                 max_tokens=400,
             )
@@ -76,7 +78,7 @@ def main():
             print(f"Tokens used: {result.tokens_used}\n")
 
             extracted_pdf = rag.extract_structured_data(
-                document=str(pdf_path),
+                document=pdf,
                 fields=fields,
             )
             print("Extracted from PDF (merged across pages):")
@@ -2,11 +2,12 @@
 Test run using test_data/chest_pain_er.pdf — query and structured extraction.
 Run from repo root with API available: python examples/test_chest_pain_pdf.py
 """
+import asyncio
 from pathlib import Path
 
 from dotenv import load_dotenv
 
-from hipaa_rag import SecureRAG
+from hipaa_rag import DocumentHandle, SecureRAG
 from hipaa_rag.loader import detect_document_type, get_page_count, get_pages
 
 load_dotenv()
@@ -19,24 +20,29 @@ def main():
     print("=== Test: chest_pain_er.pdf ===\n")
     print("1. Loader check")
     print(f"   Path: {PDF_PATH}")
-    print(f"   Exists: {PDF_PATH.exists()}")
-    if not PDF_PATH.exists():
+    try:
+        # One stat up front; the handle is reused by the loader and SecureRAG
+        pdf = DocumentHandle.open(PDF_PATH)
+    except FileNotFoundError:
         print("   ERROR: PDF not found.")
         return
-    doc_type = detect_document_type(PDF_PATH)
-    page_count = get_page_count(PDF_PATH)
+    doc_type = detect_document_type(pdf)
+    page_count = get_page_count(pdf)
     print(f"   Type: {doc_type}")
     print(f"   Page count: {page_count}")
-    pages_list = list(get_pages(PDF_PATH))
+    pages_list = list(get_pages(pdf))
     print(f"   get_pages() yielded: {len(pages_list)} page(s)\n")
 
-    # 2. Initialize RAG and run query
+    # 2. Initialize RAG and run query (pages sent concurrently)
     print("2. Query (all pages)")
     rag = SecureRAG(model="qwen2-vl", enable_audit_log=True)
-    result = rag.query(
-        document=str(PDF_PATH),
-        question="What is the chief complaint or reason for visit? Summarize key findings.",
-        max_tokens=500,
+    prepared = rag.prepare(pdf)  # render pages once for query + extraction
+    result = asyncio.run(
+        rag.aquery(
+            document=prepared,
+            question="What is the chief complaint or reason for visit? Summarize key findings.",
+            max_tokens=500,
+        )
     )
     print(f"   Pages processed: {result.page_count}")
     print(f"   Tokens used: {result.tokens_used}")
@@ -53,7 +59,7 @@ def main():
         "prescribed_medications",
     ]
     extracted = rag.extract_structured_data(
-        document=str(PDF_PATH),
+        document=prepared,
         fields=fields,
     )
     for key, value in extracted.items():
@@ -5,15 +5,28 @@ Works with: LMStudio, Ollama (with openai compatibility), Azure OpenAI, OpenAI
 import os
 import base64
 from pathlib import Path
-from openai import OpenAI
+from openai import DefaultHttpxClient, OpenAI
 from dotenv import load_dotenv
 
+try:
+    import pybase64
+except ImportError:
+    pybase64 = None
+
+from hipaa_rag import SecureRAG
+
 load_dotenv()
 
+# One keep-alive pool for every client this script creates
+HTTP_CLIENT = DefaultHttpxClient()
+
 def encode_image(image_path):
     """Encode image to base64"""
     with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+        data = image_file.read()
+    if pybase64 is not None:
+        return pybase64.b64encode_as_string(data)
+    return base64.b64encode(data).decode('ascii')
 
 def test_vision_model(image_path, base_url=None, api_key=None):
     """
@@ -37,7 +50,8 @@ def test_vision_model(image_path, base_url=None, api_key=None):
     # Initialize client
     client = OpenAI(
         base_url=base_url,
-        api_key=api_key
+        api_key=api_key,
+        http_client=HTTP_CLIENT
     )
     
     # Encode image
@@ -96,45 +110,18 @@ def test_multiple_questions(image_path):
     
     print("\n=== Testing Information Extraction ===")
     
-    base64_image = encode_image(image_path)
-    client = OpenAI(
-        base_url=os.getenv("OPENAI_BASE_URL", "http://localhost:1234/v1"),
-        api_key=os.getenv("OPENAI_API_KEY", "lm-studio")
-    )
+    # One request with all questions instead of re-sending the image per question
+    rag = SecureRAG(model="qwen2-vl", enable_audit_log=False)
     
-    for i, question in enumerate(questions, 1):
+    try:
+        answers = rag.batch_questions(str(image_path), questions, max_tokens=500)
+    except Exception as e:
+        print(f"   ✗ Error: {e}")
+        return
+    
+    for i, (question, answer) in enumerate(zip(questions, answers), 1):
         print(f"\n{i}. {question}")
-        
-        try:
-            response = client.chat.completions.create(
-                model="qwen2-vl",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text", 
-                                "text": f"Look at this medical chart and answer: {question}"
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=200,
-                temperature=0.1
-            )
-            
-            answer = response.choices[0].message.content
-            print(f"   → {answer}")
-            
-        except Exception as e:
-            print(f"   ✗ Error: {e}")
-            break
+        print(f"   → {answer}")
 
 if __name__ == "__main__":
     print("=== HIPAA RAG Vision Model Test ===\n")
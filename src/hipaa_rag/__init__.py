@@ -1,6 +1,7 @@
 """HIPAA-compliant RAG framework for medical documents"""
 
-from .core import SecureRAG, QueryResult
+from .core import SecureRAG, QueryResult, PreparedDocument
+from .loader import DocumentHandle
 
 __version__ = "0.1.0"
-__all__ = ["SecureRAG", "QueryResult"]
\ No newline at end of file
+__all__ = ["SecureRAG", "QueryResult", "PreparedDocument", "DocumentHandle"]
\ No newline at end of file
@@ -3,15 +3,67 @@ Core framework for HIPAA-compliant RAG on medical documents
 """
 import os
 import json
+import asyncio
+import atexit
 import base64
+import hashlib
+import importlib.util
 import logging
+import queue
+import re
+import struct
+import sys
+import threading
+import time
+import weakref
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import cache, lru_cache
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
-from datetime import datetime
-from typing import Optional, Dict, Any
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, Callable, Iterable, TypeVar
 from dataclasses import dataclass
-from openai import OpenAI
+from openai import (
+    NOT_GIVEN,
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+    DefaultHttpxClient,
+    OpenAI,
+    RateLimitError,
+)
+
+from .loader import (
+    JPEG_SIGNATURE,
+    DocumentHandle,
+    _resolve_document,
+    get_page_count,
+    iter_pages_prefetched,
+)
+
+try:
+    # Optional SIMD base64 codec (pip install "hipaa-rag[fast]")
+    import pybase64
+except ImportError:
+    pybase64 = None
+
+try:
+    # Optional SIMD hash for response cache keys (pip install "hipaa-rag[fast]")
+    import blake3
+except ImportError:
+    blake3 = None
 
-from .loader import get_pages, get_page_count
+try:
+    # Optional compiled JSON codec (pip install "hipaa-rag[fast]")
+    import orjson
+except ImportError:
+    orjson = None
+
+T = TypeVar("T")
+
+# Markdown code fence around model JSON; the closing fence is optional so a
+# partially streamed answer still parses once its JSON is complete
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)\s*(?:```|\Z)", re.DOTALL)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -30,10 +82,158 @@ LIST_LIKE_FIELDS = frozenset(
     )
 )
 
+# Max (page, prompt, params) -> answer entries kept per SecureRAG instance
+RESPONSE_CACHE_SIZE = 256
+
+# Max encoded page data URLs memoized per SecureRAG instance
+DATA_URL_CACHE_SIZE = 32
+
+# Default page pixel budget before encoding: Qwen2-VL's recommended upper bound
+# (max_pixels=1280*28*28, i.e. at most 1280 28x28 vision patches per page)
+DEFAULT_MAX_PIXELS = 1280 * 28 * 28
+
+# Default max in-flight page requests (override with HIPAA_RAG_CONCURRENCY)
+DEFAULT_CONCURRENCY = 8
+
+# Extra model round-trips allowed when extraction output is not valid JSON
+EXTRACTION_MAX_RETRIES = 2
+
+# Sampling temperature for self-consistency extraction (n_samples > 1)
+SAMPLING_TEMPERATURE = 0.7
+
+# Attempts per request when the backend signals a rate limit / quota error;
+# the delay doubles from RATE_LIMIT_BACKOFF up to RATE_LIMIT_MAX_BACKOFF seconds
+RATE_LIMIT_ATTEMPTS = 3
+RATE_LIMIT_BACKOFF = 1.0
+RATE_LIMIT_MAX_BACKOFF = 30.0
+# Backends behind proxies often report rate limits only in the error text
+_RATE_LIMIT_RE = re.compile(r"rate.?limit|quota|too many requests|\b429\b", re.IGNORECASE)
+
+# HTTP/2 needs the optional h2 package (pip install "hipaa-rag[fast]")
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def _is_rate_limit_error(exc: BaseException) -> bool:
+    """True for 429/quota errors worth retrying after a backoff."""
+    return isinstance(exc, RateLimitError) or bool(_RATE_LIMIT_RE.search(str(exc)))
+
+
+class _RateLimiter:
+    """Minimum-interval limiter spacing request starts at least 1/rps seconds apart."""
+
+    def __init__(self, requests_per_second: Optional[float]):
+        self._interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def reserve(self) -> float:
+        """Claim the next request slot. Returns seconds to wait before sending."""
+        if not self._interval:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_slot)
+            self._next_slot = start + self._interval
+        return start - now
+
+
+def _json_loads(text: str) -> Any:
+    """Parse JSON with orjson when installed (its errors subclass json.JSONDecodeError)."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def _json_dumps_sorted(obj: Any) -> bytes:
+    """Serialize to canonical (key-sorted) JSON bytes, e.g. for hashing."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, sort_keys=True).encode()
+
+
+def _close_pages(pages: Iterable[tuple[int, bytes]]) -> None:
+    """Close a page generator (stopping any prefetch thread and its rendered pages)."""
+    close = getattr(pages, "close", None)
+    if close is not None:
+        close()
+
+
+class _SharedHttpxClient(DefaultHttpxClient):
+    """HTTP client shared across SecureRAG instances; `close()` from any one
+    OpenAI client must not tear down the pool the others are using."""
+
+    def close(self) -> None:
+        pass
+
+
+@lru_cache(maxsize=1)
+def _shared_http_client() -> DefaultHttpxClient:
+    """Process-wide connection pool reused by every SecureRAG's sync client."""
+    return _SharedHttpxClient(http2=HTTP2_AVAILABLE)
+
+
+@lru_cache(maxsize=256)
+def _is_list_like_field(key: str) -> bool:
+    """Whether an extracted field holds a list (case-insensitive LIST_LIKE_FIELDS lookup)."""
+    return key.lower() in LIST_LIKE_FIELDS
 
-@dataclass
+
+@cache
+def _build_extract_prompt(fields: tuple[str, ...]) -> str:
+    """Extraction prompt for a field list (byte-stable per list, so backends can prefix-cache it)."""
+    fields_str = ", ".join([f'"{f}"' for f in fields])
+    example = ",\n  ".join(
+        [f'"{f}": ["value"]' if _is_list_like_field(f) else f'"{f}": "value"' for f in fields]
+    )
+    return (
+        f"Extract the following information from this medical chart: {fields_str}.\n\n"
+        f"Return the answer as valid JSON only, with no other text:\n"
+        f"{{\n  {example}\n}}"
+    )
+
+
+@lru_cache(maxsize=128)
+def _extraction_response_format(fields: tuple[str, ...]) -> Dict[str, Any]:
+    """`response_format` constraining output to a JSON object with exactly `fields`."""
+    properties = {
+        f: (
+            {"type": "array", "items": {"type": "string"}}
+            if _is_list_like_field(f)
+            else {"type": "string"}
+        )
+        for f in fields
+    }
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "extraction",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": properties,
+                "required": list(fields),
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+def _data_url(data: bytes) -> str:
+    """
+    Inline data URL for page bytes, with the MIME type sniffed from the signature.
+    The prefix is joined to the encoded bytes before the single ASCII decode.
+    """
+    if data.startswith(JPEG_SIGNATURE):
+        prefix = b"data:image/jpeg;base64,"
+    else:
+        prefix = b"data:image/png;base64,"
+    encoded = pybase64.b64encode(data) if pybase64 is not None else base64.b64encode(data)
+    return (prefix + encoded).decode("ascii")
+
+
+@dataclass(slots=True, frozen=True)
 class QueryResult:
-    """Result from a medical chart query"""
+    """Result from a medical chart query (immutable, safe to share across threads)"""
 
     question: str
     answer: str
@@ -43,6 +243,11 @@ class QueryResult:
     document_path: Optional[str] = None
     page_count: Optional[int] = None
 
+    def __post_init__(self):
+        # Every result from one SecureRAG shares the model name; intern it once
+        if self.model is not None:
+            object.__setattr__(self, "model", sys.intern(self.model))
+
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for logging/serialization"""
         return {
@@ -55,6 +260,25 @@ class QueryResult:
             "page_count": self.page_count,
         }
 
+    def to_json(self) -> str:
+        """Serialize to a JSON string (same fields as `to_dict`)"""
+        if orjson is not None:
+            # orjson serializes dataclasses and aware datetimes (ISO 8601) natively
+            return orjson.dumps(self).decode()
+        return json.dumps(self.to_dict())
+
+
+@dataclass(slots=True, frozen=True)
+class PreparedDocument:
+    """Pages of a document loaded once by `SecureRAG.prepare`, reusable across queries."""
+
+    document_path: str
+    pages: tuple[tuple[int, bytes], ...]
+
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
 
 class SecureRAG:
     """
@@ -66,6 +290,11 @@ class SecureRAG:
     - Azure OpenAI (cloud with BAA)
     - OpenAI (cloud)
     """
+
+    # Audit entry templates; %-style args so messages are only built when emitted
+    _AUDIT_QUERY_FMT = "QUERY | Document: %s | Question: %s | Tokens: %s | Model: %s"
+    _AUDIT_BATCH_FMT = "BATCH | Document: %s | Questions: %s | Tokens: %s | Model: %s"
+    _AUDIT_EXTRACT_FMT = "EXTRACT | Document: %s | Fields: %s | Model: %s"
     
     def __init__(
         self,
@@ -73,7 +302,13 @@ class SecureRAG:
         api_key: Optional[str] = None,
         model: str = "qwen2-vl",
         enable_audit_log: bool = True,
-        audit_log_path: Optional[str] = None
+        audit_log_path: Optional[str] = None,
+        concurrency: Optional[int] = None,
+        max_pixels: Optional[int] = DEFAULT_MAX_PIXELS,
+        image_detail: Optional[str] = None,
+        image_format: str = "jpeg",
+        requests_per_second: Optional[float] = None,
+        enable_cache: bool = True,
     ):
         """
         Initialize SecureRAG
@@ -84,17 +319,60 @@ class SecureRAG:
             model: Model name to use
             enable_audit_log: Whether to log all queries for compliance
             audit_log_path: Path to audit log file
+            concurrency: Max concurrent page requests (defaults to env
+                HIPAA_RAG_CONCURRENCY, else 8)
+            max_pixels: Downscale pages above this many pixels before sending
+                (fewer vision tokens and bytes); None sends full resolution
+            image_detail: Optional OpenAI image detail hint ("low", "high", "auto")
+            image_format: Page encoding sent to the model: "jpeg" (smaller payload)
+                or "png" (lossless)
+            requests_per_second: Optional cap on API request rate across all
+                threads (defaults to env HIPAA_RAG_RPS, else unlimited)
+            enable_cache: Keep recent model answers and encoded page images in
+                memory, keyed by a hash of the page image and prompt, so repeated
+                pages/questions skip the API. Both may contain PHI; disable where
+                it must not be retained in process memory beyond a single call.
         """
         self.base_url = base_url or os.getenv("OPENAI_BASE_URL", "http://localhost:1234/v1")
         self.api_key = api_key or os.getenv("OPENAI_API_KEY", "lm-studio")
         self.model = model
         self.enable_audit_log = enable_audit_log
+        self.concurrency = concurrency or int(
+            os.getenv("HIPAA_RAG_CONCURRENCY", DEFAULT_CONCURRENCY)
+        )
+        self.max_pixels = max_pixels
+        self.image_detail = image_detail
+        self.image_format = image_format
+
+        # Global request limits shared by every thread issuing API calls
+        rps = requests_per_second or float(os.getenv("HIPAA_RAG_RPS", 0))
+        self._rps_limiter = _RateLimiter(rps)
+        self._sem = threading.BoundedSemaphore(self.concurrency)
+
+        # OpenAI-compatible servers accept `n` (multiple choices per prompt);
+        # Anthropic's compatibility layer does not
+        self._supports_n = "anthropic" not in self.base_url.lower()
+
+        # Content-addressed cache: hash(page || model || params || prompt) -> (answer, tokens)
+        self.enable_cache = enable_cache
+        self._resp_cache: OrderedDict[str, tuple[str, Optional[int]]] = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # Encoded pages, memoized so repeat queries on a page skip the encode
+        self._data_url_memo = lru_cache(maxsize=DATA_URL_CACHE_SIZE)(_data_url)
         
-        # Initialize OpenAI client
+        # Initialize OpenAI clients (sync for query, async for aquery). The sync
+        # client shares one keep-alive pool across instances; async clients are
+        # created per event loop (see `aclient`), since pooled connections belong
+        # to the loop that opened them.
         self.client = OpenAI(
             base_url=self.base_url,
-            api_key=self.api_key
+            api_key=self.api_key,
+            http_client=_shared_http_client(),
         )
+        self._aclients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        # Per-loop counterpart of _sem bounding in-flight async requests
+        self._asems: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._aclient_override: Optional[AsyncOpenAI] = None
         
         # Setup audit logging
         if self.enable_audit_log:
@@ -108,117 +386,613 @@ class SecureRAG:
             self.audit_logger = logging.getLogger("hipaa_rag.audit")
             self.audit_logger.setLevel(logging.INFO)
             
-            # File handler for audit log
+            # File handler for audit log, drained by a background listener so
+            # disk writes stay off the query path
             handler = logging.FileHandler(self.audit_log_path)
             handler.setFormatter(logging.Formatter(
                 '%(asctime)s | %(message)s',
                 datefmt='%Y-%m-%d %H:%M:%S'
             ))
-            self.audit_logger.addHandler(handler)
+            audit_queue: queue.SimpleQueue = queue.SimpleQueue()
+            self._audit_queue_handler = QueueHandler(audit_queue)
+            self.audit_logger.addHandler(self._audit_queue_handler)
+            self._audit_listener = QueueListener(audit_queue, handler)
+            self._audit_listener.start()
+            atexit.register(self.close)
             
             logger.info(f"Audit logging enabled: {self.audit_log_path}")
         
         logger.info(f"SecureRAG initialized with base_url={self.base_url}, model={self.model}")
-    
+
+    @property
+    def aclient(self) -> AsyncOpenAI:
+        """
+        Async client for the running event loop. Each loop gets its own keep-alive
+        pool, so repeated `asyncio.run(rag.aquery(...))` calls don't reuse
+        connections from a closed loop. Assigning a client uses it for every loop.
+        """
+        if self._aclient_override is not None:
+            return self._aclient_override
+        loop = asyncio.get_running_loop()
+        client = self._aclients.get(loop)
+        if client is None:
+            client = self._aclients[loop] = AsyncOpenAI(
+                base_url=self.base_url,
+                api_key=self.api_key,
+                http_client=DefaultAsyncHttpxClient(http2=HTTP2_AVAILABLE),
+            )
+        return client
+
+    @aclient.setter
+    def aclient(self, client: AsyncOpenAI) -> None:
+        self._aclient_override = client
+
+    def close(self):
+        """
+        Drop cached answers and encoded pages, flush pending audit entries and
+        detach this instance's audit handler.
+        """
+        self._data_url_memo.cache_clear()
+        with self._cache_lock:
+            self._resp_cache.clear()
+        listener = getattr(self, "_audit_listener", None)
+        if listener is None:
+            return
+        self._audit_listener = None
+        # Drop the exit hook's reference so the instance (and its cache) can be freed
+        atexit.unregister(self.close)
+        self.audit_logger.removeHandler(self._audit_queue_handler)
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+    def prepare(
+        self,
+        document: str | Path | DocumentHandle,
+        max_pages: Optional[int] = None,
+    ) -> PreparedDocument:
+        """
+        Load and render a document's pages once for repeated queries.
+
+        Pass the result to `query`, `extract_structured_data`, etc. instead of the
+        path so follow-up calls skip re-reading/rasterizing and re-encoding pages.
+        """
+        document_path, pages = self._open_pages(document, max_pages)
+        return PreparedDocument(document_path=document_path, pages=tuple(pages))
+
+    def _open_pages(
+        self,
+        document: str | Path | DocumentHandle | PreparedDocument,
+        max_pages: Optional[int],
+    ) -> tuple[str, Iterable[tuple[int, bytes]]]:
+        """Resolve a document to (document_path, iterable of (page_index, png_bytes))."""
+        if isinstance(document, PreparedDocument):
+            pages = document.pages if max_pages is None else document.pages[:max_pages]
+            return document.document_path, pages
+        handle = _resolve_document(document)
+        return str(handle.path), iter_pages_prefetched(
+            handle,
+            max_pages=max_pages,
+            max_pixels=self.max_pixels,
+            image_format=self.image_format,
+        )
+
+    def _map_pages(
+        self,
+        pages: Iterable[tuple[int, bytes]],
+        fn: Callable[[int, bytes], T],
+    ) -> list[T]:
+        """
+        Run fn(page_idx, png_bytes) for every page on a thread pool of
+        self.concurrency workers; results are returned in page order.
+
+        Pages are submitted as the loader yields them, so rendering the next
+        page overlaps in-flight requests. At most 2x workers pages are held
+        at once, keeping memory bounded for long documents. Once any page
+        fails, no further pages are sent (e.g. a bad API key or endpoint
+        should not receive the rest of the chart).
+        """
+        slots = threading.Semaphore(2 * self.concurrency)
+        failed = threading.Event()
+        futures: Dict[int, Future] = {}
+
+        def on_done(future: Future) -> None:
+            slots.release()
+            if not future.cancelled() and future.exception() is not None:
+                failed.set()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            try:
+                for page_idx, png_bytes in pages:
+                    slots.acquire()
+                    if failed.is_set():
+                        break
+                    future = pool.submit(fn, page_idx, png_bytes)
+                    future.add_done_callback(on_done)
+                    futures[page_idx] = future
+                    # Only the worker should hold the page; don't pin the last one
+                    # here while waiting on results
+                    del png_bytes
+                if failed.is_set():
+                    for future in futures.values():
+                        future.cancel()
+                    for idx in sorted(futures):
+                        future = futures[idx]
+                        if future.done() and not future.cancelled() and future.exception():
+                            future.result()
+                return [futures[idx].result() for idx in sorted(futures)]
+            except BaseException:
+                for future in futures.values():
+                    future.cancel()
+                raise
+            finally:
+                _close_pages(pages)
+
+    def _cache_key(
+        self,
+        png_bytes: bytes,
+        question: str,
+        temperature: float,
+        max_tokens: int,
+        response_format: Optional[Dict[str, Any]] = None,
+        followup: Optional[list[Dict[str, Any]]] = None,
+    ) -> str:
+        """
+        Content hash identifying one page request (image bytes, model, params, prompt).
+        BLAKE3 when installed (several times faster on multi-MB pages), else SHA-256.
+        """
+        h = blake3.blake3(png_bytes) if blake3 is not None else hashlib.sha256(png_bytes)
+        h.update(self.model.encode())
+        h.update(struct.pack("<fI", temperature, max_tokens))
+        h.update(question.encode())
+        if response_format or followup:
+            h.update(_json_dumps_sorted([response_format, followup]))
+        return h.hexdigest()
+
+    def _image_payload(self, png_bytes: bytes) -> Dict[str, Any]:
+        """Image content part for one page: an inline data URL with the sniffed MIME type."""
+        # The memoized URL outlives the call; skip it when answers may not be retained
+        encode = self._data_url_memo if self.enable_cache else _data_url
+        image_url = {"url": encode(png_bytes)}
+        if self.image_detail:
+            image_url["detail"] = self.image_detail
+        return {"type": "image_url", "image_url": image_url}
+
+    def _build_messages(
+        self,
+        png_bytes: bytes,
+        question: str,
+        followup: Optional[list[Dict[str, Any]]] = None,
+    ) -> list[Dict[str, Any]]:
+        """Chat messages for one page image plus prompt (and any follow-up turns).
+
+        The image goes first: it is the long, byte-identical part across
+        questions on the same page, which lets prefix-caching backends reuse it.
+        """
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    self._image_payload(png_bytes),
+                    {"type": "text", "text": question},
+                ],
+            }
+        ]
+        if followup:
+            messages.extend(followup)
+        return messages
+
+    def _cache_get(self, key: Optional[str]) -> Optional[tuple[str, Optional[int]]]:
+        """Return cached (answer, tokens_used) for a request key, if present."""
+        if key is None:
+            return None
+        with self._cache_lock:
+            cached = self._resp_cache.get(key)
+            if cached is not None:
+                self._resp_cache.move_to_end(key)
+        if cached is not None:
+            logger.debug("Response cache hit")
+        return cached
+
+    @staticmethod
+    def _completion_result(response) -> tuple[str, Optional[int]]:
+        """Unpack a chat completion into (answer, tokens_used)."""
+        answer = response.choices[0].message.content
+        tokens_used = (
+            response.usage.total_tokens if hasattr(response, "usage") else None
+        )
+        return (answer or "", tokens_used)
+
+    def _cache_store(
+        self, key: Optional[str], result: tuple[str, Optional[int]]
+    ) -> tuple[str, Optional[int]]:
+        """Cache (answer, tokens_used) under a request key, evicting the oldest entry."""
+        if key is None:
+            return result
+        with self._cache_lock:
+            self._resp_cache[key] = result
+            if len(self._resp_cache) > RESPONSE_CACHE_SIZE:
+                self._resp_cache.popitem(last=False)
+        return result
+
     def _query_single_image(
         self,
-        base64_image: str,
+        png_bytes: bytes,
         question: str,
         temperature: float = 0.1,
         max_tokens: int = 500,
+        response_format: Optional[Dict[str, Any]] = None,
+        followup: Optional[list[Dict[str, Any]]] = None,
+        stream_until_json: bool = False,
     ) -> tuple[str, Optional[int]]:
-        """Call vision API with one image. Returns (answer, tokens_used)."""
-        response = self.client.chat.completions.create(
+        """Call vision API with one image. Returns (answer, tokens_used).
+
+        Identical (image, model, params, prompt) requests are served from an
+        in-memory LRU instead of re-hitting the API. With `stream_until_json`,
+        the response is streamed and cut off as soon as it holds a complete
+        JSON value (tokens_used is then None).
+        """
+        # Hashing multi-MB pages is only worth it when the answer can be cached
+        key = (
+            self._cache_key(
+                png_bytes, question, temperature, max_tokens, response_format, followup
+            )
+            if self.enable_cache
+            else None
+        )
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+
+        # A stream is read inside the concurrency slot, not after create() returns
+        consume = self._read_stream_until_json if stream_until_json else None
+        response = self._create_completion(
+            consume=consume,
             model=self.model,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": question},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}"
-                            },
-                        },
-                    ],
-                }
-            ],
+            messages=self._build_messages(png_bytes, question, followup),
             max_tokens=max_tokens,
             temperature=temperature,
+            response_format=response_format or NOT_GIVEN,
+            stream=stream_until_json,
         )
-        answer = response.choices[0].message.content
-        tokens_used = (
-            response.usage.total_tokens if hasattr(response, "usage") else None
+        if stream_until_json:
+            result = (response, None)
+        else:
+            result = self._completion_result(response)
+        return self._cache_store(key, result)
+
+    def _create_completion(self, consume: Optional[Callable[[Any], Any]] = None, **kwargs):
+        """
+        `client.chat.completions.create` under the global concurrency and RPS
+        limits, retrying rate-limit errors with exponential backoff.
+
+        `consume`, if given, is applied to the response while the concurrency
+        slot is still held (e.g. reading a stream) and its result returned.
+        """
+        for attempt in range(RATE_LIMIT_ATTEMPTS):
+            with self._sem:
+                delay = self._rps_limiter.reserve()
+                if delay:
+                    time.sleep(delay)
+                try:
+                    response = self.client.chat.completions.create(**kwargs)
+                    return consume(response) if consume is not None else response
+                except Exception as e:
+                    if attempt == RATE_LIMIT_ATTEMPTS - 1 or not _is_rate_limit_error(e):
+                        raise
+                    error = e
+            backoff = min(RATE_LIMIT_BACKOFF * 2**attempt, RATE_LIMIT_MAX_BACKOFF)
+            logger.warning(f"Rate limited ({error}); retrying in {backoff:.1f}s")
+            time.sleep(backoff)
+
+    def _async_semaphore(self) -> asyncio.Semaphore:
+        """Instance-wide bound of `self.concurrency` async requests on the running loop."""
+        loop = asyncio.get_running_loop()
+        sem = self._asems.get(loop)
+        if sem is None:
+            sem = self._asems[loop] = asyncio.Semaphore(self.concurrency)
+        return sem
+
+    async def _acreate_completion(self, **kwargs):
+        """
+        Async `_create_completion`: at most `self.concurrency` requests in flight
+        across all concurrent `aquery` calls on this instance, plus the RPS limit.
+        """
+        for attempt in range(RATE_LIMIT_ATTEMPTS):
+            async with self._async_semaphore():
+                delay = self._rps_limiter.reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+                try:
+                    return await self.aclient.chat.completions.create(**kwargs)
+                except Exception as e:
+                    if attempt == RATE_LIMIT_ATTEMPTS - 1 or not _is_rate_limit_error(e):
+                        raise
+                    error = e
+            backoff = min(RATE_LIMIT_BACKOFF * 2**attempt, RATE_LIMIT_MAX_BACKOFF)
+            logger.warning(f"Rate limited ({error}); retrying in {backoff:.1f}s")
+            await asyncio.sleep(backoff)
+
+    def _sample_single_image(
+        self,
+        png_bytes: bytes,
+        question: str,
+        n_samples: int,
+        temperature: float = SAMPLING_TEMPERATURE,
+        max_tokens: int = 500,
+        response_format: Optional[Dict[str, Any]] = None,
+    ) -> list[str]:
+        """
+        Draw `n_samples` answers for one image. Uses a single request with `n=`
+        where supported, so the (large) image prompt is only processed once.
+        Not cached: repeated sampling is expected to differ.
+        """
+        kwargs = dict(
+            model=self.model,
+            messages=self._build_messages(png_bytes, question),
+            max_tokens=max_tokens,
+            temperature=temperature,
+            response_format=response_format or NOT_GIVEN,
         )
-        return (answer or "", tokens_used)
+        choices = []
+        if self._supports_n:
+            choices = list(self._create_completion(n=n_samples, **kwargs).choices)
+            if len(choices) < n_samples:
+                # LM Studio / Ollama ignore `n` and return one choice; stop asking
+                logger.warning(
+                    "Backend returned %d of %d samples; requesting the rest separately",
+                    len(choices),
+                    n_samples,
+                )
+                self._supports_n = False
+        while len(choices) < n_samples:
+            choices.append(self._create_completion(**kwargs).choices[0])
+        return [choice.message.content or "" for choice in choices]
+
+    def _read_stream_until_json(self, stream) -> str:
+        """Accumulate streamed deltas, closing the stream once they parse as JSON."""
+        parts: list[str] = []
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                parts.append(delta)
+                # Only a closing bracket can complete the top-level value
+                if "}" in delta or "]" in delta:
+                    try:
+                        self._parse_extraction_response("".join(parts))
+                    except ValueError:
+                        continue
+                    logger.debug("JSON complete; closing stream early")
+                    break
+        finally:
+            stream.close()
+        return "".join(parts)
+
+    async def _aquery_single_image(
+        self,
+        png_bytes: bytes,
+        question: str,
+        temperature: float = 0.1,
+        max_tokens: int = 500,
+        response_format: Optional[Dict[str, Any]] = None,
+        followup: Optional[list[Dict[str, Any]]] = None,
+    ) -> tuple[str, Optional[int]]:
+        """Async variant of `_query_single_image` (shares the response cache)."""
+        # Hashing multi-MB pages is only worth it when the answer can be cached
+        key = (
+            self._cache_key(
+                png_bytes, question, temperature, max_tokens, response_format, followup
+            )
+            if self.enable_cache
+            else None
+        )
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+
+        response = await self._acreate_completion(
+            model=self.model,
+            messages=self._build_messages(png_bytes, question, followup),
+            max_tokens=max_tokens,
+            temperature=temperature,
+            response_format=response_format or NOT_GIVEN,
+        )
+        return self._cache_store(key, self._completion_result(response))
 
     def query(
         self,
-        document: str,
+        document: str | Path | DocumentHandle | PreparedDocument,
         question: str,
         temperature: float = 0.1,
         max_tokens: int = 500,
         max_pages: Optional[int] = None,
+        response_format: Optional[Dict[str, Any]] = None,
     ) -> QueryResult:
         """
         Query a medical document (image, PDF, or multi-page TIFF).
 
         Args:
-            document: Path to document (PNG, JPEG, PDF, TIFF, etc.)
+            document: Path to document (PNG, JPEG, PDF, TIFF, etc.), a DocumentHandle,
+                or a PreparedDocument from `prepare`
             question: Question to ask about the document
             temperature: Model temperature (lower = more focused)
             max_tokens: Maximum tokens per page response
             max_pages: Optional cap on pages processed (e.g. for very large PDFs)
+            response_format: Optional OpenAI `response_format` (e.g. a json_schema)
 
         Returns:
             QueryResult with combined answer and metadata
         """
-        document_path = str(Path(document).resolve())
-        logger.info(f"Querying document: {document_path}")
-        logger.info(f"Question: {question}")
+        document_path, pages = self._open_pages(document, max_pages)
+        logger.info("Querying document: %s", document_path)
+        logger.info("Question: %s", question)
 
-        page_answers: list[str] = []
-        total_tokens = 0
-
-        for page_idx, png_bytes in get_pages(document_path, max_pages=max_pages):
-            base64_image = base64.b64encode(png_bytes).decode("utf-8")
+        def run_page(page_idx: int, png_bytes: bytes) -> tuple[str, Optional[int]]:
             try:
                 answer, tokens_used = self._query_single_image(
-                    base64_image,
+                    png_bytes,
                     question,
                     temperature=temperature,
                     max_tokens=max_tokens,
+                    response_format=response_format,
                 )
-                page_answers.append(answer)
-                if tokens_used is not None:
-                    total_tokens += tokens_used
-                logger.debug(f"Page {page_idx + 1} done. Tokens: {tokens_used}")
             except Exception as e:
                 logger.error(f"Query failed on page {page_idx + 1}: {e}")
                 raise
+            logger.debug("Page %d done. Tokens: %s", page_idx + 1, tokens_used)
+            return answer, tokens_used
+
+        page_results = self._map_pages(pages, run_page)
+
+        page_answers = [answer for answer, _ in page_results]
+        total_tokens = sum(t for _, t in page_results if t is not None)
+        return self._finish_query(document_path, question, page_answers, total_tokens)
+
+    async def aquery(
+        self,
+        document: str | Path | DocumentHandle | PreparedDocument,
+        question: str,
+        temperature: float = 0.1,
+        max_tokens: int = 500,
+        max_pages: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        response_format: Optional[Dict[str, Any]] = None,
+    ) -> QueryResult:
+        """
+        Async `query`: page requests run concurrently instead of one after another.
 
+        Args:
+            document: Path to document (PNG, JPEG, PDF, TIFF, etc.), a DocumentHandle,
+                or a PreparedDocument from `prepare`
+            question: Question to ask about the document
+            temperature: Model temperature (lower = more focused)
+            max_tokens: Maximum tokens per page response
+            max_pages: Optional cap on pages processed (e.g. for very large PDFs)
+            concurrency: Max in-flight page requests (defaults to self.concurrency)
+            response_format: Optional OpenAI `response_format` (e.g. a json_schema)
+
+        Returns:
+            QueryResult with combined answer and metadata
+        """
+        document_path, pages = self._open_pages(document, max_pages)
+        logger.info("Querying document (async): %s", document_path)
+        logger.info("Question: %s", question)
+
+        sem = asyncio.Semaphore(concurrency or self.concurrency)
+
+        async def run_page(page_idx: int, png_bytes: bytes) -> tuple[str, Optional[int]]:
+            async with sem:
+                try:
+                    return await self._aquery_single_image(
+                        png_bytes,
+                        question,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        response_format=response_format,
+                    )
+                except Exception as e:
+                    logger.error(f"Query failed on page {page_idx + 1}: {e}")
+                    raise
+
+        # Render pages off the event loop and start each request as its page
+        # arrives; like _map_pages, hold at most 2x concurrency pages and stop
+        # pulling pages once one has failed
+        slots = asyncio.Semaphore(2 * (concurrency or self.concurrency))
+        page_iter = iter(pages)
+        tasks: list[asyncio.Task] = []
+        failed = asyncio.Event()
+
+        def on_done(task: asyncio.Task) -> None:
+            slots.release()
+            if not task.cancelled() and task.exception() is not None:
+                failed.set()
+
+        try:
+            while True:
+                await slots.acquire()
+                if failed.is_set():
+                    break
+                page = await asyncio.to_thread(next, page_iter, None)
+                if page is None:
+                    break
+                task = asyncio.create_task(run_page(*page))
+                task.add_done_callback(on_done)
+                tasks.append(task)
+                del page
+            page_results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            _close_pages(page_iter)
+
+        page_answers = [answer for answer, _ in page_results]
+        total_tokens = sum(t for _, t in page_results if t is not None)
+        return self._finish_query(document_path, question, page_answers, total_tokens)
+
+    def query_batch(
+        self,
+        document: str | Path | DocumentHandle | PreparedDocument,
+        questions: list[str],
+        temperature: float = 0.1,
+        max_tokens: int = 500,
+        max_pages: Optional[int] = None,
+        concurrency: int = 4,
+    ) -> list[QueryResult]:
+        """
+        Ask independent questions about one document concurrently.
+
+        Unlike `batch_questions` (one combined prompt), each question is its own
+        `query` with its own QueryResult and audit entry; the requests run on a
+        thread pool so wall time is roughly that of the slowest question.
+
+        Returns:
+            One QueryResult per question, in order
+        """
+        if not questions:
+            return []
+        if not isinstance(document, PreparedDocument):
+            document = self.prepare(document, max_pages=max_pages)
+
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(questions))) as pool:
+            futures = [
+                pool.submit(
+                    self.query,
+                    document,
+                    question,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    max_pages=max_pages,
+                )
+                for question in questions
+            ]
+            return [f.result() for f in futures]
+
+    def _finish_query(
+        self,
+        document_path: str,
+        question: str,
+        page_answers: list[str],
+        total_tokens: int,
+    ) -> QueryResult:
+        """Combine per-page answers into a QueryResult and write the audit entry."""
         if not page_answers:
             raise ValueError(f"No pages processed for document: {document_path}")
 
-        # Combine answers
-        if len(page_answers) == 1:
-            combined = page_answers[0]
-        else:
-            parts = [
-                f"--- Page {i + 1} ---\n{a}"
-                for i, a in enumerate(page_answers)
-                if (a and a.strip())
-            ]
-            combined = "\n\n".join(parts)
+        combined = self._combine_page_answers(page_answers)
 
         page_count = len(page_answers)
-        logger.info(f"Query successful. Pages: {page_count}, Tokens: {total_tokens}")
+        logger.info("Query successful. Pages: %s, Tokens: %s", page_count, total_tokens)
 
         result = QueryResult(
             question=question,
             answer=combined,
-            timestamp=datetime.now(),
+            timestamp=datetime.now(timezone.utc),
             tokens_used=total_tokens or None,
             model=self.model,
             document_path=document_path,
@@ -229,115 +1003,321 @@ class SecureRAG:
             self._log_query(result)
 
         return result
-    
+
+
+    @staticmethod
+    def _combine_page_answers(
+        page_answers: list[str], page_indices: Optional[list[int]] = None
+    ) -> str:
+        """
+        Join per-page answers, labelling pages when there is more than one.
+        `page_indices` gives each answer's 0-based page when some pages were skipped.
+        """
+        if len(page_answers) == 1:
+            return page_answers[0]
+        if page_indices is None:
+            page_indices = list(range(len(page_answers)))
+        parts = [
+            f"--- Page {i + 1} ---\n{a}"
+            for i, a in zip(page_indices, page_answers)
+            if (a and a.strip())
+        ]
+        return "\n\n".join(parts)
+
+    def batch_questions(
+        self,
+        document: str | Path | DocumentHandle | PreparedDocument,
+        questions: list[str],
+        max_tokens: int = 500,
+        max_pages: Optional[int] = None,
+    ) -> list[str]:
+        """
+        Answer several questions about a document in one VLM call per page.
+
+        The image is sent once with a numbered list of questions instead of once
+        per question. Multi-page: each answer is combined across pages like `query`.
+
+        Returns:
+            One answer per question, in order ("" where the model gave none)
+        """
+        numbered = "\n".join(f"{i + 1}. {q}" for i, q in enumerate(questions))
+        prompt = (
+            "Answer each question about this medical chart. "
+            "Return the answers as a valid JSON list of strings, in order, with no other text.\n\n"
+            f"{numbered}"
+        )
+
+        document_path, pages = self._open_pages(document, max_pages)
+        logger.info("Batch querying document: %s (%d questions)", document_path, len(questions))
+
+        def run_page(
+            page_idx: int, png_bytes: bytes
+        ) -> tuple[int, Optional[list[str]], Optional[int]]:
+            answer, tokens_used = self._query_single_image(
+                png_bytes,
+                prompt,
+                max_tokens=max_tokens,
+                temperature=0.1,
+            )
+            try:
+                parsed = self._parse_extraction_response(answer)
+            except ValueError as e:
+                logger.warning(
+                    f"Failed to parse JSON from page {page_idx + 1}: {e}. Raw: {answer[:200]}"
+                )
+                return page_idx, None, tokens_used
+            if not isinstance(parsed, list):
+                logger.warning(f"Expected JSON list from page {page_idx + 1}, got {type(parsed).__name__}")
+                return page_idx, None, tokens_used
+            answers = [str(a) if a is not None else "" for a in parsed[: len(questions)]]
+            answers += [""] * (len(questions) - len(answers))
+            return page_idx, answers, tokens_used
+
+        page_results = self._map_pages(pages, run_page)
+
+        parsed_pages = [
+            (page_idx, answers)
+            for page_idx, answers, _ in page_results
+            if answers is not None
+        ]
+        page_indices = [page_idx for page_idx, _ in parsed_pages]
+        total_tokens = sum(t for _, _, t in page_results if t is not None)
+
+        results = [
+            self._combine_page_answers(
+                [answers[i] for _, answers in parsed_pages], page_indices
+            )
+            if parsed_pages
+            else ""
+            for i in range(len(questions))
+        ]
+
+        # Audit every page sent to the model, including ones whose answer didn't parse
+        if self.enable_audit_log:
+            self.audit_logger.info(
+                self._AUDIT_BATCH_FMT,
+                self._audit_document(document_path, len(page_results)),
+                questions,
+                total_tokens or None,
+                self.model,
+            )
+
+        return results
+
+    @staticmethod
+    def _audit_document(document_path: str, page_count: Optional[int]) -> str:
+        """Document field of an audit entry, noting the page count for multi-page documents."""
+        if page_count is not None and page_count > 1:
+            return f"{document_path} ({page_count} pages)"
+        return document_path
+
     def _log_query(self, result: QueryResult):
         """Log query to audit trail (one entry per document)."""
-        doc_part = result.document_path or ""
-        if result.page_count is not None and result.page_count > 1:
-            doc_part = f"{doc_part} ({result.page_count} pages)"
-        log_entry = (
-            f"QUERY | Document: {doc_part} | "
-            f"Question: {result.question} | "
-            f"Tokens: {result.tokens_used} | "
-            f"Model: {result.model}"
+        self.audit_logger.info(
+            self._AUDIT_QUERY_FMT,
+            self._audit_document(result.document_path or "", result.page_count),
+            result.question,
+            result.tokens_used,
+            result.model,
         )
-        self.audit_logger.info(log_entry)
 
-    def _parse_extraction_response(self, response_text: str) -> Dict[str, Any]:
+    def _parse_extraction_response(self, response_text: str) -> Any:
         """Parse JSON from model response (strip markdown code fence if present)."""
         text = response_text.strip()
-        if text.startswith("```"):
-            parts = text.split("```")
-            if len(parts) >= 2:
-                text = parts[1]
-                if text.startswith("json"):
-                    text = text[4:]
-        text = text.strip()
-        return json.loads(text)
+        fenced = _FENCE_RE.match(text)
+        if fenced:
+            text = fenced.group(1)
+        return _json_loads(text)
 
     def _merge_extracted_pages(
         self, page_dicts: list[Dict[str, Any]]
     ) -> Dict[str, Any]:
         """Merge per-page extraction dicts: first non-empty for scalars, concat+dedupe for list-like."""
         merged: Dict[str, Any] = {}
+        # List-like values collect into insertion-ordered sets in one pass
+        lists: Dict[str, Dict[str, None]] = {}
         for d in page_dicts:
             if not isinstance(d, dict):
                 continue
             for k, v in d.items():
-                key_lower = k.lower()
-                if key_lower in LIST_LIKE_FIELDS:
-                    # List-like: collect all values, dedupe
+                if _is_list_like_field(k):
+                    items = lists.get(k)
+                    if items is None:
+                        items = lists[k] = {}
+                        merged[k] = None  # placeholder keeps first-seen key order
                     if not isinstance(v, list):
                         v = [v] if v not in (None, "") else []
-                    existing = merged.get(k)
-                    if existing is None:
-                        merged[k] = list(dict.fromkeys(str(x).strip() for x in v if x))
-                    else:
-                        if not isinstance(existing, list):
-                            existing = [existing]
-                        merged[k] = list(
-                            dict.fromkeys(
-                                existing + [str(x).strip() for x in v if x]
-                            )
-                        )
+                    for x in v:
+                        if x:
+                            items[str(x).strip()] = None
                 else:
                     # First non-empty wins
                     if k not in merged or not merged[k]:
                         if v is not None and str(v).strip():
                             merged[k] = v
+        for k, items in lists.items():
+            merged[k] = list(items)
         return merged
 
+    def _vote_extracted_samples(
+        self, samples: list[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Self-consistency merge of one page's sampled extractions: most common value
+        for scalars; list-like items kept if at least half the samples contain them."""
+        quorum = (len(samples) + 1) // 2
+        voted: Dict[str, Any] = {}
+        for k in dict.fromkeys(k for d in samples for k in d):
+            values = [d[k] for d in samples if d.get(k) not in (None, "", [])]
+            if _is_list_like_field(k):
+                counts: Counter = Counter()
+                for v in values:
+                    items = v if isinstance(v, list) else [v]
+                    counts.update(list(dict.fromkeys(str(x).strip() for x in items if x)))
+                voted[k] = [item for item, c in counts.items() if c >= quorum]
+            elif values:
+                counts = Counter(str(v).strip() for v in values)
+                best = counts.most_common(1)[0][0]
+                voted[k] = next(v for v in values if str(v).strip() == best)
+        return voted
+
+    def _extract_page_sampled(
+        self,
+        png_bytes: bytes,
+        prompt: str,
+        response_format: Optional[Dict[str, Any]],
+        n_samples: int,
+    ) -> Optional[Dict[str, Any]]:
+        """Extract one page from `n_samples` candidates merged by majority vote."""
+        candidates = self._sample_single_image(
+            png_bytes,
+            prompt,
+            n_samples,
+            max_tokens=300,
+            response_format=response_format,
+        )
+        parsed: list[Dict[str, Any]] = []
+        for answer in candidates:
+            try:
+                candidate = self._parse_extraction_response(answer)
+            except ValueError:
+                continue
+            if isinstance(candidate, dict):
+                parsed.append(candidate)
+        if not parsed:
+            raise ValueError(f"none of {len(candidates)} sampled outputs was a JSON object")
+        return self._vote_extracted_samples(parsed)
+
+    def _extract_page(
+        self,
+        png_bytes: bytes,
+        prompt: str,
+        response_format: Optional[Dict[str, Any]],
+        max_retries: int,
+        stream_until_json: bool = False,
+    ) -> Optional[Dict[str, Any]]:
+        """Extract one page's JSON object, feeding parse errors back to the model on retry."""
+        followup: list[Dict[str, Any]] = []
+        for attempt in range(max_retries + 1):
+            answer, _ = self._query_single_image(
+                png_bytes,
+                prompt,
+                max_tokens=300,
+                temperature=0.0,
+                response_format=response_format,
+                followup=followup,
+                stream_until_json=stream_until_json,
+            )
+            try:
+                parsed = self._parse_extraction_response(answer)
+                if not isinstance(parsed, dict):
+                    raise ValueError(f"expected a JSON object, got {type(parsed).__name__}")
+                return parsed
+            except ValueError as e:  # includes json.JSONDecodeError
+                if attempt == max_retries:
+                    raise
+                logger.info(f"Extraction output invalid (attempt {attempt + 1}): {e}. Retrying")
+                followup = followup + [
+                    {"role": "assistant", "content": answer},
+                    {
+                        "role": "user",
+                        "content": f"Your output had error: {e}. Fix it and return only the JSON object.",
+                    },
+                ]
+        return None
+
     def extract_structured_data(
         self,
-        document: str,
+        document: str | Path | DocumentHandle | PreparedDocument,
         fields: list[str],
         max_pages: Optional[int] = None,
+        use_json_schema: bool = True,
+        max_retries: int = EXTRACTION_MAX_RETRIES,
+        stream_until_json: bool = False,
+        n_samples: int = 1,
     ) -> Dict[str, Any]:
         """
         Extract specific fields from a medical document (image, PDF, or TIFF).
         Multi-page: merges per-page JSON (first non-empty for scalars, concat+dedupe for list-like fields).
+
+        Args:
+            document: Path to document (PNG, JPEG, PDF, TIFF, etc.), a DocumentHandle,
+                or a PreparedDocument from `prepare`
+            fields: Field names to extract
+            max_pages: Optional cap on pages processed
+            use_json_schema: Constrain output with a `json_schema` response_format
+                (disable for backends without structured output support)
+            max_retries: Extra attempts per page when the output is not valid JSON
+            stream_until_json: Stream each page's response and stop generation as
+                soon as a complete JSON object has arrived
+            n_samples: Sample this many extractions per page (one request with
+                `n=`, topped up with single requests on backends that ignore it)
+                and merge them by majority vote; 1 disables sampling. Sampled
+                pages don't use `max_retries` (unparseable samples are dropped
+                from the vote) and can't be combined with `stream_until_json`.
         """
-        fields_str = ", ".join([f'"{f}"' for f in fields])
-        example = ",\n  ".join([f'"{f}": "value"' for f in fields])
-        prompt = (
-            f"Extract the following information from this medical chart: {fields_str}.\n\n"
-            f"Return the answer as valid JSON only, with no other text:\n"
-            f"{{\n  {example}\n}}"
+        if n_samples > 1 and stream_until_json:
+            raise ValueError("stream_until_json is not supported with n_samples > 1")
+        # Deduplicated, in the caller's order (strict outputs follow the schema's key order)
+        field_names = tuple(dict.fromkeys(fields))
+        prompt = _build_extract_prompt(field_names)
+        response_format = (
+            _extraction_response_format(field_names) if use_json_schema else None
         )
 
-        document_path = str(Path(document).resolve())
-        page_dicts: list[Dict[str, Any]] = []
+        document_path, pages = self._open_pages(document, max_pages)
 
-        for page_idx, png_bytes in get_pages(document_path, max_pages=max_pages):
-            base64_image = base64.b64encode(png_bytes).decode("utf-8")
-            answer, _ = self._query_single_image(
-                base64_image,
-                prompt,
-                max_tokens=300,
-                temperature=0.0,
-            )
+        def run_page(page_idx: int, png_bytes: bytes) -> Optional[Dict[str, Any]]:
             try:
-                parsed = self._parse_extraction_response(answer)
-                page_dicts.append(parsed)
-            except json.JSONDecodeError as e:
-                logger.warning(
-                    f"Failed to parse JSON from page {page_idx + 1}: {e}. Raw: {answer[:200]}"
+                if n_samples > 1:
+                    return self._extract_page_sampled(
+                        png_bytes, prompt, response_format, n_samples
+                    )
+                return self._extract_page(
+                    png_bytes, prompt, response_format, max_retries, stream_until_json
                 )
+            except ValueError as e:
+                logger.warning(f"Failed to parse JSON from page {page_idx + 1}: {e}")
+                return None
 
-        if not page_dicts:
-            return {}
+        page_results = self._map_pages(pages, run_page)
+        page_dicts = [d for d in page_results if d is not None]
 
-        merged = self._merge_extracted_pages(page_dicts)
+        merged = self._merge_extracted_pages(page_dicts) if page_dicts else {}
         logger.info(
-            f"Extracted {len(merged)} fields from {len(page_dicts)} page(s): {list(merged.keys())}"
+            "Extracted %d fields from %d page(s): %s",
+            len(merged),
+            len(page_dicts),
+            list(merged),
         )
 
-        # Audit: one entry for the whole document
+        # Audit: one entry for the whole document, counting every page sent to
+        # the model (including pages whose output never parsed)
         if self.enable_audit_log:
-            page_count = len(page_dicts)
-            doc_part = f"{document_path} ({page_count} pages)" if page_count > 1 else document_path
             self.audit_logger.info(
-                f"EXTRACT | Document: {doc_part} | Fields: {list(merged.keys())} | Model: {self.model}"
+                self._AUDIT_EXTRACT_FMT,
+                self._audit_document(document_path, len(page_results)),
+                list(merged.keys()),
+                self.model,
             )
 
         return merged
\ No newline at end of file
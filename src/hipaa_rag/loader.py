@@ -2,9 +2,24 @@
 Document loader: detect type and yield pages as images for PDF, TIFF, and image files.
 """
 import logging
+import math
+import os
+import queue
+import threading
+from contextlib import closing
+from dataclasses import dataclass
+from functools import lru_cache
+from io import BytesIO
 from pathlib import Path
 from typing import Iterator
 
+from PIL import Image
+
+try:
+    import pymupdf  # PDF rasterization
+except ImportError:
+    pymupdf = None
+
 logger = logging.getLogger(__name__)
 
 # Magic bytes for file type detection
@@ -19,6 +34,57 @@ IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif"}
 PDF_EXTENSIONS = {".pdf"}
 TIFF_EXTENSIONS = {".tif", ".tiff"}
 
+# Default PDF rasterization resolution
+PDF_RENDER_DPI = 150
+
+# Page output encodings; JPEG is far smaller for scanned/photographic charts
+PAGE_FORMATS = {"png", "jpeg"}
+JPEG_QUALITY = 85
+# Pages are base64'd straight into a request, so favour encode speed over PNG size
+PNG_COMPRESS_LEVEL = 1
+_PASSTHROUGH_SUFFIXES = {"png": {".png"}, "jpeg": {".jpg", ".jpeg"}}
+
+# Pages rendered ahead of the consumer by iter_pages_prefetched
+PAGE_PREFETCH = 4
+
+
+@dataclass(slots=True, frozen=True)
+class DocumentHandle:
+    """
+    A document path validated with a single stat.
+    Pass it to the loader or SecureRAG instead of a path to skip repeated existence checks.
+    """
+
+    path: Path
+    size: int
+    mtime_ns: int
+
+    @classmethod
+    def open(cls, path: str | Path) -> "DocumentHandle":
+        """Resolve and stat `path` once. Raises FileNotFoundError if missing."""
+        path = Path(os.path.abspath(path))
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Document not found: {path}") from None
+        return cls(path=path, size=st.st_size, mtime_ns=st.st_mtime_ns)
+
+    def __fspath__(self) -> str:
+        return str(self.path)
+
+
+def _resolve_document(document_path: str | Path | DocumentHandle) -> DocumentHandle:
+    """Handle for a document; stats it once unless given an already-stat'd handle."""
+    if isinstance(document_path, DocumentHandle):
+        return document_path
+    return DocumentHandle.open(document_path)
+
+
+def _require_pymupdf() -> None:
+    """Raise ImportError if PyMuPDF (needed for PDFs) is not installed."""
+    if pymupdf is None:
+        raise ImportError("PyMuPDF is required for PDF documents: pip install pymupdf")
+
 
 def _read_magic(path: str | Path, size: int = 12) -> bytes:
     """Read first bytes of file for magic number detection."""
@@ -26,16 +92,41 @@ def _read_magic(path: str | Path, size: int = 12) -> bytes:
         return f.read(size)
 
 
-def detect_document_type(path: str | Path) -> str:
+def _trust_extension_default() -> bool:
+    """Whether HIPAA_RAG_TRUST_EXT=1 enables extension-only type detection."""
+    return os.getenv("HIPAA_RAG_TRUST_EXT", "0") == "1"
+
+
+def detect_document_type(
+    path: str | Path | DocumentHandle, trust_extension: bool | None = None
+) -> str:
     """
     Detect document type from path (extension + magic bytes).
     Returns one of: "pdf", "tiff", "image".
+
+    trust_extension: if true, a known extension decides the type without reading
+    the file (for trusted batch inputs). Defaults to env HIPAA_RAG_TRUST_EXT=1.
     """
-    path = Path(path)
-    if not path.exists():
-        raise FileNotFoundError(f"Document not found: {path}")
+    if trust_extension is None:
+        trust_extension = _trust_extension_default()
+    return _detect_type(_resolve_document(path), trust_extension)
 
+
+@lru_cache(maxsize=1024)
+def _detect_type(handle: DocumentHandle, trust_extension: bool = False) -> str:
+    """
+    Detect type of an existing document (no existence check).
+    Memoized on (path, size, mtime), so a modified file is re-read.
+    """
+    path = handle.path
     suffix = path.suffix.lower()
+    if trust_extension:
+        if suffix in PDF_EXTENSIONS:
+            return "pdf"
+        if suffix in TIFF_EXTENSIONS:
+            return "tiff"
+        if suffix in IMAGE_EXTENSIONS:
+            return "image"
     magic = _read_magic(path)
 
     if magic.startswith(PDF_SIGNATURE) or suffix in PDF_EXTENSIONS:
@@ -56,62 +147,118 @@ def detect_document_type(path: str | Path) -> str:
     )
 
 
+def _pdf_render_dpi(width_pt: float, height_pt: float, max_pixels: int | None) -> int:
+    """Render DPI for a PDF page: PDF_RENDER_DPI, lowered to fit within max_pixels."""
+    dpi = PDF_RENDER_DPI
+    if max_pixels is not None:
+        pixels = (width_pt * dpi / 72) * (height_pt * dpi / 72)
+        if pixels > max_pixels:
+            dpi = max(1, int(dpi * math.sqrt(max_pixels / pixels)))
+    return dpi
+
+
+def _fit_to_pixels(img, max_pixels: int | None):
+    """Downscale a PIL image (keeping aspect ratio) so width*height <= max_pixels."""
+    w, h = img.size
+    if max_pixels is None or w * h <= max_pixels:
+        return img
+    scale = math.sqrt(max_pixels / (w * h))
+    size = (max(1, int(w * scale)), max(1, int(h * scale)))
+    if img.mode == "1":
+        # Pillow falls back to nearest-neighbour for bilevel images (fax-style
+        # scans), dropping thin strokes; resample in greyscale instead
+        img = img.convert("L")
+    return img.resize(size, Image.Resampling.LANCZOS)
+
+
+def _save_image(img, image_format: str) -> bytes:
+    """Encode a PIL image as PNG (fast, low compression) or JPEG (at JPEG_QUALITY) bytes."""
+    buf = BytesIO()
+    if image_format == "jpeg":
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(buf, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    else:
+        img.save(buf, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    return buf.getvalue()
+
+
 def get_pages(
-    document_path: str | Path,
+    document_path: str | Path | DocumentHandle,
     max_pages: int | None = None,
+    max_pixels: int | None = None,
+    image_format: str = "png",
 ) -> Iterator[tuple[int, bytes]]:
     """
     Yield (page_index, png_bytes) for each page. 0-based page index.
     Single-page formats (PNG, JPEG, etc.) yield one item.
-    Memory-efficient: one page in memory at a time.
+    Memory-efficient: one page in memory at a time. The document is validated
+    (exists, supported type) when called, before the first page is requested.
+
+    max_pixels: if set, pages larger than this many pixels are downscaled
+    (PDFs are rendered at a lower DPI instead of resized after the fact).
+    image_format: "png" (default) or "jpeg" for the yielded page bytes.
     """
-    path = Path(document_path)
-    if not path.exists():
-        raise FileNotFoundError(f"Document not found: {path}")
+    if image_format not in PAGE_FORMATS:
+        raise ValueError(f"Unsupported page format: {image_format}. Supported: png, jpeg.")
+    handle = _resolve_document(document_path)
+    doc_type = _detect_type(handle, _trust_extension_default())
+    return _get_pages_validated(handle.path, doc_type, max_pages, max_pixels, image_format)
 
-    doc_type = detect_document_type(path)
+
+def _get_pages_validated(
+    path: Path,
+    doc_type: str,
+    max_pages: int | None,
+    max_pixels: int | None,
+    image_format: str,
+) -> Iterator[tuple[int, bytes]]:
+    """Page generator behind get_pages, for a document already stat'd and typed."""
     count = 0
 
     if doc_type == "pdf":
-        import fitz
-
-        doc = fitz.open(path)
+        _require_pymupdf()
+        # Zoom matrix for the default DPI, built once; pages that must be rendered
+        # smaller to fit max_pixels get their own
+        default_zoom = PDF_RENDER_DPI / 72
+        default_matrix = pymupdf.Matrix(default_zoom, default_zoom)
+        doc = pymupdf.open(path)
         try:
-            for i in range(len(doc)):
+            for i in range(doc.page_count):
                 if max_pages is not None and count >= max_pages:
                     break
                 page = doc.load_page(i)
-                pix = page.get_pixmap(dpi=150, alpha=False)
-                png_bytes = pix.tobytes("png")
+                dpi = _pdf_render_dpi(page.rect.width, page.rect.height, max_pixels)
+                if dpi == PDF_RENDER_DPI:
+                    matrix = default_matrix
+                else:
+                    matrix = pymupdf.Matrix(dpi / 72, dpi / 72)
+                pix = page.get_pixmap(matrix=matrix, alpha=False)
+                if image_format == "jpeg":
+                    png_bytes = pix.tobytes("jpeg", jpg_quality=JPEG_QUALITY)
+                else:
+                    # MuPDF's PNG writer uses default zlib effort; encode via Pillow
+                    # at PNG_COMPRESS_LEVEL instead
+                    img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+                    png_bytes = _save_image(img, "png")
                 yield (i, png_bytes)
                 count += 1
         finally:
             doc.close()
 
     elif doc_type == "tiff":
-        from io import BytesIO
-
-        from PIL import Image
-
         img = Image.open(path)
-        if img.mode in ("RGBA", "P"):
-            img = img.convert("RGB")
-        n = 0
-        while True:
-            try:
-                img.seek(n)
-            except EOFError:
-                break
-            if max_pages is not None and count >= max_pages:
-                break
-            buf = BytesIO()
-            frame = img.copy()
-            if frame.mode in ("RGBA", "P"):
-                frame = frame.convert("RGB")
-            frame.save(buf, format="PNG")
-            yield (n, buf.getvalue())
+        # n_frames walks the IFD chain once, without decoding frames
+        n_frames = getattr(img, "n_frames", 1)
+        if max_pages is not None:
+            n_frames = min(n_frames, max_pages)
+        for n in range(n_frames):
+            img.seek(n)
+            # Encode the seek'd frame in place; convert/resize allocate only when needed
+            frame = img.convert("RGB") if img.mode in ("RGBA", "P") else img
+            frame = _fit_to_pixels(frame, max_pixels)
+            yield (n, _save_image(frame, image_format))
             count += 1
-            n += 1
         if count == 0:
             raise ValueError(f"No pages found in TIFF: {path}")
 
@@ -121,50 +268,94 @@ def get_pages(
             return
         with open(path, "rb") as f:
             data = f.read()
-        # Normalize to PNG for API consistency (JPEG/WebP often accepted; we can pass through)
-        if path.suffix.lower() in {".png"}:
+        img = Image.open(BytesIO(data))  # lazy: reads the header only
+        w, h = img.size
+        within_budget = max_pixels is None or w * h <= max_pixels
+        # Normalize to image_format for API consistency (pass through if already in it)
+        if path.suffix.lower() in _PASSTHROUGH_SUFFIXES[image_format] and within_budget:
             yield (0, data)
         else:
-            from io import BytesIO
-
-            from PIL import Image
-
-            img = Image.open(BytesIO(data))
             if img.mode in ("RGBA", "P"):
                 img = img.convert("RGB")
-            buf = BytesIO()
-            img.save(buf, format="PNG")
-            yield (0, buf.getvalue())
+            img = _fit_to_pixels(img, max_pixels)
+            yield (0, _save_image(img, image_format))
 
 
-def get_page_count(document_path: str | Path) -> int:
-    """Return number of pages without loading page data."""
-    path = Path(document_path)
-    if not path.exists():
-        raise FileNotFoundError(f"Document not found: {path}")
+def iter_pages_prefetched(
+    document_path: str | Path | DocumentHandle,
+    max_pages: int | None = None,
+    prefetch: int = PAGE_PREFETCH,
+    **kwargs,
+) -> Iterator[tuple[int, bytes]]:
+    """
+    Like get_pages, but pages are rendered on a background thread up to `prefetch`
+    pages ahead, so rasterization overlaps whatever the consumer does with each page.
+    Extra keyword arguments are passed to get_pages. The document is validated
+    up front; rendering errors are re-raised in the consumer, and closing the
+    iterator early stops the producer.
+    """
+    return _prefetch(get_pages(document_path, max_pages, **kwargs), prefetch)
 
-    doc_type = detect_document_type(path)
 
-    if doc_type == "pdf":
-        import fitz
+def _prefetch(
+    pages: Iterator[tuple[int, bytes]], prefetch: int
+) -> Iterator[tuple[int, bytes]]:
+    """Drain a page iterator on a producer thread through a bounded queue."""
+    pending: queue.Queue = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            with closing(pages):
+                for page in pages:
+                    if not put(page):
+                        return
+        except BaseException as e:
+            put(e)
+        else:
+            put(done)
+
+    producer = threading.Thread(target=produce, name="hipaa-rag-prefetch", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = pending.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
 
-        doc = fitz.open(path)
+
+def get_page_count(document_path: str | Path | DocumentHandle) -> int:
+    """Return number of pages without loading page data."""
+    handle = _resolve_document(document_path)
+    path = handle.path
+    doc_type = _detect_type(handle, _trust_extension_default())
+
+    if doc_type == "pdf":
+        _require_pymupdf()
+        doc = pymupdf.open(path)
         try:
-            return len(doc)
+            return doc.page_count
         finally:
             doc.close()
 
     if doc_type == "tiff":
-        from PIL import Image
-
-        img = Image.open(path)
-        n = 0
-        while True:
-            try:
-                img.seek(n)
-                n += 1
-            except EOFError:
-                break
-        return n
+        with Image.open(path) as img:
+            return getattr(img, "n_frames", 1)
 
     return 1
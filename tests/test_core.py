@@ -1,9 +1,101 @@
 """Tests for core SecureRAG logic (merge, parse) without API calls."""
+import asyncio
+import gc
 import json
+import threading
+import time
+import weakref
+from dataclasses import FrozenInstanceError
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
 
+import pymupdf
 import pytest
 
-from hipaa_rag.core import SecureRAG
+import hipaa_rag.core as core
+from hipaa_rag import PreparedDocument
+from hipaa_rag.core import (
+    QueryResult,
+    SecureRAG,
+    _build_extract_prompt,
+    _extraction_response_format,
+    _RateLimiter,
+)
+
+SAMPLE_IMAGE = Path(__file__).parent.parent / "test_data" / "bronchitis_chart.png"
+
+
+def fake_response(content, tokens=10):
+    """Chat completion response; a list of contents becomes one choice each."""
+    contents = content if isinstance(content, list) else [content]
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=c)) for c in contents],
+        usage=SimpleNamespace(total_tokens=tokens),
+    )
+
+
+class FakeCompletions:
+    """Stand-in for client.chat.completions that records calls."""
+
+    def __init__(self, answer="ok", tokens=10):
+        # A list of answers is returned one per call (last one repeats)
+        self.answers = answer if isinstance(answer, list) else [answer]
+        self.tokens = tokens
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        answer = self.answers[min(len(self.calls), len(self.answers)) - 1]
+        return fake_response(answer, self.tokens)
+
+
+class FakeAsyncCompletions(FakeCompletions):
+    async def create(self, **kwargs):
+        return FakeCompletions.create(self, **kwargs)
+
+
+@pytest.fixture
+def sample_image():
+    if not SAMPLE_IMAGE.exists():
+        pytest.skip("test_data/bronchitis_chart.png not found")
+    return SAMPLE_IMAGE
+
+
+def make_rag_with_fake_client(answer="ok"):
+    rag = SecureRAG(enable_audit_log=False)
+    completions = FakeCompletions(answer)
+    rag.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return rag, completions
+
+
+def test_query_result_is_frozen_and_serializes_utc():
+    result = QueryResult(
+        question="q",
+        answer="a",
+        timestamp=datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+        model="qwen2-vl",
+    )
+    with pytest.raises(FrozenInstanceError):
+        result.answer = "changed"
+    assert result.to_dict()["timestamp"] == "2024-01-02T03:04:05+00:00"
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_query_result_to_json_matches_to_dict(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(core, "orjson", None)
+    result = QueryResult(
+        question="q",
+        answer="a",
+        timestamp=datetime(2024, 1, 2, 3, 4, 5, 678000, tzinfo=timezone.utc),
+        tokens_used=12,
+        model="qwen2-vl",
+        document_path="chart.pdf",
+        page_count=2,
+    )
+    assert json.loads(result.to_json()) == result.to_dict()
 
 
 def test_parse_extraction_response_plain_json():
@@ -27,6 +119,34 @@ def test_parse_extraction_response_json_block_with_lang():
     assert out == {"x": 1}
 
 
+def test_parse_extraction_response_unclosed_fence():
+    rag = SecureRAG(enable_audit_log=False)
+    assert rag._parse_extraction_response('```\n["a", "b"]\n') == ["a", "b"]
+    assert rag._parse_extraction_response('```json\n{"x": 1}') == {"x": 1}
+
+
+def test_parse_extraction_response_without_orjson(monkeypatch):
+    monkeypatch.setattr(core, "orjson", None)
+    rag = SecureRAG(enable_audit_log=False)
+    assert rag._parse_extraction_response('{"a": "b"}') == {"a": "b"}
+    with pytest.raises(json.JSONDecodeError):
+        rag._parse_extraction_response("not json")
+
+
+def test_image_payload_sniffs_mime_type():
+    rag = SecureRAG(enable_audit_log=False)
+    png = rag._image_payload(b"\x89PNG\r\n\x1a\n....")
+    jpeg = rag._image_payload(b"\xff\xd8\xff\xe0....")
+    assert png["image_url"]["url"].startswith("data:image/png;base64,")
+    assert jpeg["image_url"]["url"].startswith("data:image/jpeg;base64,")
+
+
+def test_image_payload_detail_hint():
+    rag = SecureRAG(enable_audit_log=False, image_detail="low")
+    payload = rag._image_payload(b"\x89PNG\r\n\x1a\n....")
+    assert payload["image_url"]["detail"] == "low"
+
+
 def test_merge_extracted_pages_first_non_empty():
     rag = SecureRAG(enable_audit_log=False)
     page_dicts = [
@@ -75,3 +195,514 @@ def test_merge_extracted_pages_skips_non_dict():
     page_dicts = [{"a": "1"}, "not a dict", {"b": "2"}]
     merged = rag._merge_extracted_pages(page_dicts)
     assert merged == {"a": "1", "b": "2"}
+
+
+def test_query_repeat_is_served_from_cache(sample_image):
+    rag, completions = make_rag_with_fake_client("Acute bronchitis")
+    first = rag.query(str(sample_image), "Diagnosis?")
+    second = rag.query(str(sample_image), "Diagnosis?")
+    assert first.answer == second.answer == "Acute bronchitis"
+    assert len(completions.calls) == 1
+
+    rag.query(str(sample_image), "Diagnosis?", max_tokens=100)
+    assert len(completions.calls) == 2
+
+
+def test_query_cache_can_be_disabled(sample_image):
+    rag, completions = make_rag_with_fake_client("Acute bronchitis")
+    rag.enable_cache = False
+    rag.query(str(sample_image), "Diagnosis?")
+    rag.query(str(sample_image), "Diagnosis?")
+    assert len(completions.calls) == 2
+    assert not rag._resp_cache
+
+
+def test_disabled_cache_skips_key_hashing(monkeypatch, sample_image):
+    rag, completions = make_rag_with_fake_client("Acute bronchitis")
+    rag.enable_cache = False
+
+    def fail(*args, **kwargs):
+        raise AssertionError("cache key should not be computed")
+
+    monkeypatch.setattr(rag, "_cache_key", fail)
+    assert rag.query(str(sample_image), "Diagnosis?").answer == "Acute bronchitis"
+
+
+def test_image_payload_not_memoized_when_cache_disabled():
+    rag = SecureRAG(enable_audit_log=False, enable_cache=False)
+    rag._image_payload(b"\xff\xd8 page bytes")
+    assert rag._data_url_memo.cache_info().currsize == 0
+
+
+def test_encoded_pages_are_per_instance_and_dropped_on_close():
+    rag = SecureRAG(enable_audit_log=False)
+    other = SecureRAG(enable_audit_log=False)
+    rag._image_payload(b"\xff\xd8 page bytes")
+    assert rag._data_url_memo.cache_info().currsize == 1
+    assert other._data_url_memo.cache_info().currsize == 0
+    rag.close()
+    assert rag._data_url_memo.cache_info().currsize == 0
+
+
+def test_batch_questions_single_call_ordered_answers(sample_image):
+    rag, completions = make_rag_with_fake_client('```json\n["Jane Doe", "J20.9"]\n```')
+    answers = rag.batch_questions(str(sample_image), ["Name?", "ICD-10?", "Follow up?"])
+    assert answers == ["Jane Doe", "J20.9", ""]
+    assert len(completions.calls) == 1
+    image_part, text_part = completions.calls[0]["messages"][0]["content"]
+    assert image_part["type"] == "image_url"
+    prompt = text_part["text"]
+    assert "1. Name?" in prompt and "3. Follow up?" in prompt
+
+
+def test_batch_questions_labels_pages_by_index_when_one_fails(tmp_path):
+    prepared = PreparedDocument(
+        document_path="chart.pdf",
+        pages=((0, b"page-0"), (1, b"page-1"), (2, b"page-2")),
+    )
+    answers_by_page = {
+        SecureRAG(enable_audit_log=False)._image_payload(data)["image_url"]["url"]: answer
+        for (_, data), answer in zip(prepared.pages, ['["Jane"]', "not json", '["Doe"]'])
+    }
+
+    def create(**kwargs):
+        url = kwargs["messages"][0]["content"][0]["image_url"]["url"]
+        return fake_response(answers_by_page[url], tokens=1)
+
+    audit_path = tmp_path / "audit.log"
+    rag = SecureRAG(audit_log_path=str(audit_path))
+    rag.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    answers = rag.batch_questions(prepared, ["Name?"])
+    rag.close()
+    assert answers == ["--- Page 1 ---\nJane\n\n--- Page 3 ---\nDoe"]
+    assert "chart.pdf (3 pages)" in audit_path.read_text()
+
+
+def test_aquery_fans_out_pages(tmp_path, sample_image):
+    pdf_path = tmp_path / "two_pages.pdf"
+    doc = pymupdf.open()
+    for _ in range(2):
+        page = doc.new_page()
+        page.insert_image(page.rect, filename=str(sample_image))
+    doc.save(str(pdf_path))
+    doc.close()
+
+    rag = SecureRAG(enable_audit_log=False)
+    completions = FakeAsyncCompletions("Chest pain")
+    rag.aclient = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    result = asyncio.run(rag.aquery(str(pdf_path), "Chief complaint?", concurrency=2))
+    assert result.page_count == 2
+    assert result.answer == "--- Page 1 ---\nChest pain\n\n--- Page 2 ---\nChest pain"
+
+
+def test_concurrent_aqueries_share_instance_concurrency_limit(sample_image):
+    rag = SecureRAG(enable_audit_log=False, concurrency=1, enable_cache=False)
+    in_flight = []
+    peak = []
+
+    async def create(**kwargs):
+        in_flight.append(1)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.05)
+        in_flight.pop()
+        return fake_response("Chest pain")
+
+    rag.aclient = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    async def run_three():
+        return await asyncio.gather(
+            *(rag.aquery(str(sample_image), q) for q in ("A?", "B?", "C?"))
+        )
+
+    results = asyncio.run(run_three())
+    assert [r.answer for r in results] == ["Chest pain"] * 3
+    assert max(peak) == 1
+
+
+def test_aquery_renders_pages_off_the_event_loop(monkeypatch, sample_image):
+    loop_thread = threading.get_ident()
+    render_threads = []
+
+    def fake_pages(*args, **kwargs):
+        for idx in range(3):
+            render_threads.append(threading.get_ident())
+            yield idx, sample_image.read_bytes()
+
+    monkeypatch.setattr(core, "iter_pages_prefetched", fake_pages)
+    rag = SecureRAG(enable_audit_log=False)
+    completions = FakeAsyncCompletions("Chest pain")
+    rag.aclient = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    result = asyncio.run(rag.aquery(str(sample_image), "Chief complaint?"))
+    assert result.page_count == 3
+    assert loop_thread not in render_threads
+
+
+def test_audit_log_written_by_background_listener(tmp_path, sample_image):
+    audit_path = tmp_path / "audit.log"
+    rag = SecureRAG(audit_log_path=str(audit_path))
+    rag.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+    rag.query(str(sample_image), "Diagnosis?")
+    rag.close()
+    lines = audit_path.read_text().splitlines()
+    assert len(lines) == 1
+    assert "QUERY | Document:" in lines[0]
+    assert "Question: Diagnosis?" in lines[0]
+
+
+def test_closed_instance_can_be_garbage_collected(tmp_path):
+    rag = SecureRAG(audit_log_path=str(tmp_path / "audit.log"))
+    ref = weakref.ref(rag)
+    rag.close()
+    del rag
+    gc.collect()
+    assert ref() is None
+
+
+def test_extraction_response_format_schema():
+    fmt = _extraction_response_format(("patient_name", "prescribed_medications"))
+    schema = fmt["json_schema"]["schema"]
+    assert fmt["type"] == "json_schema"
+    assert schema["required"] == ["patient_name", "prescribed_medications"]
+    assert schema["properties"]["patient_name"] == {"type": "string"}
+    assert schema["properties"]["prescribed_medications"]["type"] == "array"
+    assert schema["additionalProperties"] is False
+
+
+def test_build_extract_prompt_lists_every_field():
+    prompt = _build_extract_prompt(("patient_name", "allergies", "follow_up"))
+    for field in ("patient_name", "follow_up"):
+        assert f'"{field}": "value"' in prompt
+    assert '"allergies": ["value"]' in prompt  # list-like, matching the schema
+    assert _build_extract_prompt(("patient_name", "allergies", "follow_up")) is prompt
+
+
+def test_extract_structured_data_dedupes_fields_in_caller_order(sample_image):
+    rag, completions = make_rag_with_fake_client('{"visit_date": "1/1", "allergies": []}')
+    rag.extract_structured_data(str(sample_image), ["visit_date", "allergies", "visit_date"])
+    schema = completions.calls[0]["response_format"]["json_schema"]["schema"]
+    assert schema["required"] == ["visit_date", "allergies"]
+    assert list(schema["properties"]) == ["visit_date", "allergies"]
+
+
+def test_extract_structured_data_retries_with_error_feedback(sample_image):
+    rag, completions = make_rag_with_fake_client(
+        ['{"patient_name": "Jane"', '{"patient_name": "Jane Doe"}']
+    )
+    out = rag.extract_structured_data(str(sample_image), ["patient_name"])
+    assert out == {"patient_name": "Jane Doe"}
+    assert len(completions.calls) == 2
+    retry_messages = completions.calls[1]["messages"]
+    assert retry_messages[1] == {"role": "assistant", "content": '{"patient_name": "Jane"'}
+    assert "Your output had error" in retry_messages[2]["content"]
+    assert completions.calls[1]["response_format"]["type"] == "json_schema"
+
+
+def test_extract_structured_data_gives_up_after_max_retries(sample_image):
+    rag, completions = make_rag_with_fake_client("not json")
+    out = rag.extract_structured_data(str(sample_image), ["patient_name"], max_retries=1)
+    assert out == {}
+    assert len(completions.calls) == 2
+
+
+def test_extract_structured_data_audits_pages_sent_even_when_none_parse(tmp_path):
+    prepared = PreparedDocument(
+        document_path="chart.pdf",
+        pages=((0, b"page-0"), (1, b"page-1"), (2, b"page-2")),
+    )
+    audit_path = tmp_path / "audit.log"
+    rag = SecureRAG(audit_log_path=str(audit_path))
+    rag.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions("not json")))
+    assert rag.extract_structured_data(prepared, ["patient_name"], max_retries=0) == {}
+    rag.close()
+    lines = audit_path.read_text().splitlines()
+    assert len(lines) == 1
+    assert "EXTRACT | Document: chart.pdf (3 pages)" in lines[0]
+
+
+class FakeStream:
+    """Iterable of streamed chunks that records how far it was consumed."""
+
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.consumed = 0
+        self.closed = False
+
+    def __iter__(self):
+        for delta in self.deltas:
+            self.consumed += 1
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))]
+            )
+
+    def close(self):
+        self.closed = True
+
+
+def test_extract_structured_data_stream_stops_at_complete_json(sample_image):
+    stream = FakeStream(['{"patient_name": ', '"Jane Doe"', "}", "\n\nExplanation:", " ..."])
+    rag = SecureRAG(enable_audit_log=False)
+    rag.client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kw: stream))
+    )
+    out = rag.extract_structured_data(
+        str(sample_image), ["patient_name"], stream_until_json=True
+    )
+    assert out == {"patient_name": "Jane Doe"}
+    assert stream.consumed == 3
+    assert stream.closed
+
+
+def test_stream_is_read_while_holding_concurrency_slot(sample_image):
+    rag = SecureRAG(enable_audit_log=False, concurrency=1)
+    held = []
+
+    class SlotCheckingStream(FakeStream):
+        def __iter__(self):
+            held.append(not rag._sem.acquire(blocking=False))
+            return super().__iter__()
+
+    stream = SlotCheckingStream(['{"patient_name": "Jane"}'])
+    rag.client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kw: stream))
+    )
+    rag.extract_structured_data(str(sample_image), ["patient_name"], stream_until_json=True)
+    assert held == [True]
+
+
+def test_prepared_document_reused_across_calls(monkeypatch, sample_image):
+    rag, completions = make_rag_with_fake_client('{"patient_name": "Jane"}')
+    prepared = rag.prepare(str(sample_image))
+    assert prepared.page_count == 1
+    assert prepared.document_path == str(sample_image.resolve())
+
+    def fail(*args, **kwargs):
+        raise AssertionError("document should not be reloaded")
+
+    monkeypatch.setattr(core, "iter_pages_prefetched", fail)
+    result = rag.query(prepared, "Name?")
+    extracted = rag.extract_structured_data(prepared, ["patient_name"])
+    assert result.document_path == prepared.document_path
+    assert extracted == {"patient_name": "Jane"}
+    assert len(completions.calls) == 2
+
+
+def test_query_batch_returns_results_in_question_order(sample_image):
+    rag = SecureRAG(enable_audit_log=False)
+
+    def create(**kwargs):
+        question = kwargs["messages"][0]["content"][1]["text"]
+        return fake_response(f"answer to {question}", tokens=5)
+
+    rag.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    questions = ["Name?", "DOB?", "Diagnosis?", "Medications?", "Follow up?"]
+    results = rag.query_batch(str(sample_image), questions, concurrency=3)
+    assert [r.question for r in results] == questions
+    assert [r.answer for r in results] == [f"answer to {q}" for q in questions]
+
+
+def test_query_parallel_pages_keep_page_order(tmp_path):
+    pdf_path = tmp_path / "sized_pages.pdf"
+    doc = pymupdf.open()
+    doc.new_page(width=200, height=200)
+    doc.new_page(width=400, height=400)
+    doc.save(str(pdf_path))
+    doc.close()
+
+    rag = SecureRAG(enable_audit_log=False, concurrency=2, image_format="png")
+    sizes = []
+
+    def create(**kwargs):
+        url = kwargs["messages"][0]["content"][0]["image_url"]["url"]
+        sizes.append(len(url))
+        if len(sizes) == 1:
+            time.sleep(0.2)  # first page finishes last
+        return fake_response(str(len(url)), tokens=1)
+
+    rag.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    result = rag.query(str(pdf_path), "Chief complaint?")
+    first, second = [part.split("\n")[1] for part in result.answer.split("\n\n")]
+    assert int(first) < int(second)
+    assert result.tokens_used == 2
+
+
+def test_query_stops_sending_pages_after_a_failure(tmp_path):
+    pdf_path = tmp_path / "long_chart.pdf"
+    doc = pymupdf.open()
+    for _ in range(40):
+        doc.new_page(width=100, height=100)
+    doc.save(str(pdf_path))
+    doc.close()
+
+    rag = SecureRAG(enable_audit_log=False, concurrency=2)
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        raise RuntimeError("401 invalid api key")
+
+    rag.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    with pytest.raises(RuntimeError, match="401"):
+        rag.query(str(pdf_path), "Chief complaint?")
+    assert len(calls) <= 2 * rag.concurrency
+
+
+def test_failed_queries_stop_the_prefetch_thread(tmp_path):
+    pdf_path = tmp_path / "long_chart.pdf"
+    doc = pymupdf.open()
+    for _ in range(20):
+        doc.new_page(width=100, height=100)
+    doc.save(str(pdf_path))
+    doc.close()
+
+    def create(**kwargs):
+        raise RuntimeError("401 invalid api key")
+
+    async def acreate(**kwargs):
+        raise RuntimeError("401 invalid api key")
+
+    def prefetch_threads():
+        return [t for t in threading.enumerate() if t.name == "hipaa-rag-prefetch"]
+
+    rag = SecureRAG(enable_audit_log=False, concurrency=1)
+    rag.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    rag.aclient = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=acreate)))
+    with pytest.raises(RuntimeError, match="401"):
+        rag.query(str(pdf_path), "Chief complaint?")
+    assert not prefetch_threads()
+    with pytest.raises(RuntimeError, match="401"):
+        asyncio.run(rag.aquery(str(pdf_path), "Chief complaint?"))
+    assert not prefetch_threads()
+
+
+def test_rate_limited_request_is_retried(monkeypatch, sample_image):
+    monkeypatch.setattr(core, "RATE_LIMIT_BACKOFF", 0.0)
+    rag, completions = make_rag_with_fake_client("J20.9")
+    real_create = completions.create
+    attempts = []
+
+    def flaky_create(**kwargs):
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RuntimeError("Error code: 429 - Rate limit reached")
+        return real_create(**kwargs)
+
+    completions.create = flaky_create
+    assert rag.query(str(sample_image), "ICD-10?").answer == "J20.9"
+    assert len(attempts) == 3
+
+
+def test_non_rate_limit_error_is_not_retried(sample_image):
+    rag, completions = make_rag_with_fake_client()
+    attempts = []
+
+    def broken_create(**kwargs):
+        attempts.append(1)
+        raise RuntimeError("model not loaded")
+
+    completions.create = broken_create
+    with pytest.raises(RuntimeError, match="model not loaded"):
+        rag.query(str(sample_image), "ICD-10?")
+    assert len(attempts) == 1
+
+
+def test_rate_limiter_spaces_requests():
+    limiter = _RateLimiter(requests_per_second=10)
+    delays = [limiter.reserve() for _ in range(3)]
+    assert delays[0] == 0.0
+    assert delays[2] == pytest.approx(0.2, abs=0.02)
+    assert _RateLimiter(None).reserve() == 0.0
+
+
+def test_vote_extracted_samples_majority():
+    rag = SecureRAG(enable_audit_log=False)
+    samples = [
+        {"patient_name": "Jane Doe", "allergies": ["Penicillin", "Latex"]},
+        {"patient_name": "Jane Roe", "allergies": ["Penicillin"]},
+        {"patient_name": "Jane Doe", "allergies": ["Penicillin", "Peanuts"]},
+    ]
+    voted = rag._vote_extracted_samples(samples)
+    assert voted == {"patient_name": "Jane Doe", "allergies": ["Penicillin"]}
+
+
+def test_extract_structured_data_samples_with_single_n_request(sample_image):
+    rag = SecureRAG(enable_audit_log=False)
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        contents = ['{"dob": "01/15/1980"}', '{"dob": "01/16/1980"}', '{"dob": "01/15/1980"}']
+        return fake_response(contents)
+
+    rag.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    out = rag.extract_structured_data(str(sample_image), ["dob"], n_samples=3)
+    assert out == {"dob": "01/15/1980"}
+    assert len(calls) == 1
+    assert calls[0]["n"] == 3
+
+
+def test_sampling_tops_up_when_backend_ignores_n(sample_image):
+    rag, completions = make_rag_with_fake_client(
+        ['{"dob": "01/15/1980"}', '{"dob": "01/16/1980"}', '{"dob": "01/16/1980"}']
+    )
+    out = rag.extract_structured_data(str(sample_image), ["dob"], n_samples=3)
+    assert out == {"dob": "01/16/1980"}
+    assert len(completions.calls) == 3
+    assert "n" not in completions.calls[-1]
+
+
+def test_sampling_rejects_stream_until_json():
+    rag = SecureRAG(enable_audit_log=False)
+    with pytest.raises(ValueError, match="n_samples"):
+        rag.extract_structured_data(str(SAMPLE_IMAGE), ["dob"], n_samples=3, stream_until_json=True)
+
+
+def test_closing_one_client_keeps_shared_pool_open():
+    a = SecureRAG(enable_audit_log=False)
+    b = SecureRAG(enable_audit_log=False)
+    a.client.close()
+    assert not b.client._client.is_closed
+    assert not SecureRAG(enable_audit_log=False).client._client.is_closed
+
+
+@pytest.fixture
+def openai_server():
+    """Local OpenAI-compatible endpoint (HTTP/1.1 keep-alive) answering every chat completion."""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            body = json.dumps({
+                "id": "chatcmpl-1",
+                "object": "chat.completion",
+                "created": 0,
+                "model": "qwen2-vl",
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": "Chest pain"},
+                }],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+def test_aquery_works_across_event_loops(openai_server, sample_image):
+    rag = SecureRAG(base_url=openai_server, api_key="test", enable_audit_log=False)
+    first = asyncio.run(rag.aquery(str(sample_image), "Chief complaint?"))
+    second = asyncio.run(rag.aquery(str(sample_image), "Chief complaint?", temperature=0.2))
+    assert first.answer == second.answer == "Chest pain"
@@ -5,7 +5,13 @@ from pathlib import Path
 
 import pytest
 
-from hipaa_rag.loader import detect_document_type, get_page_count, get_pages
+from hipaa_rag.loader import (
+    DocumentHandle,
+    detect_document_type,
+    get_page_count,
+    get_pages,
+    iter_pages_prefetched,
+)
 
 
 @pytest.fixture
@@ -39,6 +45,19 @@ def test_get_pages_single_image(sample_image_path):
     assert png_bytes[:8] == b"\x89PNG\r\n\x1a\n"
 
 
+def test_document_handle_open(sample_image_path):
+    handle = DocumentHandle.open(sample_image_path)
+    assert handle.path == sample_image_path.resolve()
+    assert handle.size == sample_image_path.stat().st_size
+    assert detect_document_type(handle) == "image"
+    assert [idx for idx, _ in get_pages(handle)] == [0]
+
+
+def test_document_handle_open_raises_for_missing_file():
+    with pytest.raises(FileNotFoundError):
+        DocumentHandle.open("/nonexistent/file.png")
+
+
 def test_get_page_count_single_image(sample_image_path):
     assert get_page_count(sample_image_path) == 1
 
@@ -50,15 +69,37 @@ def test_get_pages_respects_max_pages(sample_image_path):
     assert len(pages) == 0
 
 
+def test_get_pages_downscales_to_max_pixels(sample_image_path):
+    from io import BytesIO
+
+    from PIL import Image
+
+    (_, png_bytes), = get_pages(sample_image_path, max_pixels=256 * 256)
+    w, h = Image.open(BytesIO(png_bytes)).size
+    assert w * h <= 256 * 256
+    assert png_bytes[:8] == b"\x89PNG\r\n\x1a\n"
+
+
+def test_get_pages_jpeg_from_png(sample_image_path):
+    (_, jpeg_bytes), = get_pages(sample_image_path, image_format="jpeg")
+    assert jpeg_bytes[:2] == b"\xff\xd8"
+    assert len(jpeg_bytes) < sample_image_path.stat().st_size
+
+
+def test_get_pages_rejects_unknown_format(sample_image_path):
+    with pytest.raises(ValueError, match="Unsupported page format"):
+        list(get_pages(sample_image_path, image_format="gif"))
+
+
 @pytest.fixture
 def sample_pdf_path(test_data_dir):
     """Create a 2-page PDF from test images."""
-    import fitz
+    import pymupdf
 
     img1 = test_data_dir / "bronchitis_chart.png"
     if not img1.exists():
         pytest.skip("test_data/bronchitis_chart.png not found")
-    doc = fitz.open()
+    doc = pymupdf.open()
     page = doc.new_page()
     page.insert_image(page.rect, filename=str(img1))
     page2 = doc.new_page()
@@ -89,6 +130,23 @@ def test_get_pages_pdf_max_pages(sample_pdf_path):
     assert len(pages) == 1
 
 
+def test_get_pages_pdf_max_pixels(sample_pdf_path):
+    from io import BytesIO
+
+    from PIL import Image
+
+    for _, png_bytes in get_pages(sample_pdf_path, max_pixels=300 * 400):
+        w, h = Image.open(BytesIO(png_bytes)).size
+        assert w * h <= 300 * 400 * 1.02  # allow rounding of the render size
+
+
+def test_get_pages_pdf_jpeg(sample_pdf_path):
+    pages = list(get_pages(sample_pdf_path, image_format="jpeg"))
+    assert len(pages) == 2
+    for _, jpeg_bytes in pages:
+        assert jpeg_bytes[:2] == b"\xff\xd8"
+
+
 def test_get_page_count_pdf(sample_pdf_path):
     assert get_page_count(sample_pdf_path) == 2
 
@@ -103,3 +161,68 @@ def test_unsupported_type_raises(test_data_dir):
             detect_document_type(path)
     finally:
         Path(path).unlink(missing_ok=True)
+
+
+def test_detect_document_type_rechecks_modified_file(tmp_path):
+    path = tmp_path / "doc.bin"
+    path.write_bytes(b"\x89PNG\r\n\x1a\n" + b"\x00" * 8)
+    assert detect_document_type(path) == "image"
+    path.write_bytes(b"%PDF-1.7")
+    assert detect_document_type(path) == "pdf"
+
+
+def test_iter_pages_prefetched_matches_get_pages(sample_pdf_path):
+    expected = list(get_pages(sample_pdf_path, max_pixels=100_000))
+    prefetched = iter_pages_prefetched(sample_pdf_path, prefetch=1, max_pixels=100_000)
+    assert list(prefetched) == expected
+    first = iter_pages_prefetched(sample_pdf_path, max_pages=1, max_pixels=100_000)
+    assert list(first) == expected[:1]
+
+
+def test_page_iterators_validate_document_when_called():
+    with pytest.raises(FileNotFoundError):
+        get_pages(Path("/nonexistent/file.pdf"))
+    with pytest.raises(FileNotFoundError):
+        iter_pages_prefetched(Path("/nonexistent/file.pdf"))
+
+
+def test_get_pages_multipage_tiff(tmp_path):
+    from PIL import Image
+
+    path = tmp_path / "chart.tiff"
+    frames = [Image.new("P", (40, 30), color=i) for i in range(3)]
+    frames[0].save(path, save_all=True, append_images=frames[1:])
+    pages = list(get_pages(path))
+    assert [idx for idx, _ in pages] == [0, 1, 2]
+    assert get_page_count(path) == 3
+    assert all(data.startswith(b"\x89PNG") for _, data in pages)
+
+
+def test_detect_document_type_trust_extension(tmp_path, monkeypatch):
+    path = tmp_path / "scan.png"
+    path.write_bytes(b"%PDF-1.7")
+    assert detect_document_type(path) == "pdf"
+    assert detect_document_type(path, trust_extension=True) == "image"
+    monkeypatch.setenv("HIPAA_RAG_TRUST_EXT", "1")
+    assert detect_document_type(path) == "image"
+
+
+def test_get_pages_downscales_bilevel_tiff_in_greyscale(tmp_path):
+    from io import BytesIO
+
+    from PIL import Image
+
+    path = tmp_path / "fax.tiff"
+    Image.new("1", (1000, 1000), color=1).save(path, compression="group4")
+    (_, data), = get_pages(path, max_pixels=250_000)
+    page = Image.open(BytesIO(data))
+    assert page.mode == "L"
+    assert page.size[0] * page.size[1] <= 250_000
+
+
+def test_relative_and_absolute_paths_resolve_to_the_same_handle(tmp_path, monkeypatch):
+    from hipaa_rag.loader import _resolve_document
+
+    (tmp_path / "chart.png").write_bytes(b"\x89PNG\r\n\x1a\n")
+    monkeypatch.chdir(tmp_path)
+    assert _resolve_document("chart.png") == DocumentHandle.open(tmp_path / "chart.png")